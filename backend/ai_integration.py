@@ -1,18 +1,31 @@
 import os
-import json
+import asyncio
+import hashlib
+import datetime
 import google.generativeai as genai
+from google.generativeai import caching
+from pydantic import ValidationError
+from . import prompt_cache, models
 
-def get_widget_code_from_gemini(user_prompt: str, schema: str) -> dict:
-    """
-    Generates a full Python+HTML widget from a user prompt and database schema.
-    Can create widgets for DB queries, plotting, calculations, or image manipulation.
-    """
-    api_key = ""
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY environment variable not set.")
-    genai.configure(api_key=api_key)
+# --- CONFIGURATION ---
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+GENERATION_CONFIG = {"response_mime_type": "application/json"}
+# Context caching (only used for prompts large enough for the API to accept) needs
+# an explicitly versioned model; regular requests use the 'gemini-1.5-flash' alias.
+CACHED_MODEL_NAME = "models/gemini-1.5-flash-001"
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+# The API rejects context caches smaller than this many tokens
+CONTEXT_CACHE_MIN_TOKENS = 32768
+
+# Server-side cached system prompt: (prompt hash, cached_content, expires_at)
+_CONTEXT_CACHE: tuple[str, caching.CachedContent, datetime.datetime] | None = None
 
-    system_prompt = f"""
+# Configure the client and build the model once per process rather than per request.
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+_MODEL = genai.GenerativeModel('gemini-1.5-flash', generation_config=GENERATION_CONFIG)
+
+_SYSTEM_PROMPT_TEMPLATE = """
     You are an expert AI that creates self-contained Python and HTML widgets.
     Your sole output must be a single, valid JSON object with the keys "name", "category", "python_code", and "html_code".
 
@@ -59,19 +72,100 @@ def get_widget_code_from_gemini(user_prompt: str, schema: str) -> dict:
     - "name": A short, descriptive name (e.g., "Platinum Member Lookup", "Add Banner to Image").
     - "category": Choose ONE: "query", "numerical", "graphs", "image", "records".
     """
+
+# Rendered system prompts keyed by schema; the schema rarely changes, so this stays tiny.
+_RENDERED_PROMPTS: dict[str, str] = {}
+
+
+def _render_system_prompt(schema: str) -> str:
+    """Returns the system prompt for `schema`, rendering the template only once per schema."""
+    rendered = _RENDERED_PROMPTS.get(schema)
+    if rendered is None:
+        rendered = _SYSTEM_PROMPT_TEMPLATE.format(schema=schema)
+        _RENDERED_PROMPTS.clear()
+        _RENDERED_PROMPTS[schema] = rendered
+    return rendered
+
+
+def _get_context_cache(system_prompt: str) -> caching.CachedContent | None:
+    """
+    Returns a Gemini context cache holding `system_prompt`, creating it if needed.
+    Returns None (send the prompt inline) when the prompt is below the API's minimum
+    cacheable size, which is currently always the case, or if creation fails.
+    """
+    global _CONTEXT_CACHE
+    # Rough estimate (~4 characters per token).
+    if len(system_prompt) // 4 < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+
+    key = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if _CONTEXT_CACHE and _CONTEXT_CACHE[0] == key and _CONTEXT_CACHE[2] > now:
+        return _CONTEXT_CACHE[1]
+    try:
+        cached_content = caching.CachedContent.create(
+            model=CACHED_MODEL_NAME,
+            system_instruction=system_prompt,
+            ttl=CONTEXT_CACHE_TTL,
+        )
+    except Exception as e:
+        print(f"Warning: Gemini context caching unavailable, sending system prompt inline - {e}")
+        return None
+    # Refresh a little before the server-side TTL runs out.
+    _CONTEXT_CACHE = (key, cached_content, now + CONTEXT_CACHE_TTL - datetime.timedelta(minutes=5))
+    print(f"Created Gemini context cache '{cached_content.name}' for the system prompt.")
+    return cached_content
+
+
+async def get_widget_code_from_gemini(user_prompt: str, schema: str, bypass_cache: bool = False) -> models.WidgetCreate:
+    """
+    Generates a full Python+HTML widget from a user prompt and database schema.
+    Can create widgets for DB queries, plotting, calculations, or image manipulation.
+    Responses are cached by exact prompt and, when embeddings are available, by
+    semantic similarity. Set `bypass_cache` to force a fresh generation.
+    """
+    if not bypass_cache:
+        cached = await asyncio.to_thread(prompt_cache.get_exact, user_prompt, schema)
+        if cached is not None:
+            print(f"Exact prompt cache hit for: '{user_prompt}'")
+            return models.WidgetCreate(**cached)
+
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY environment variable not set.")
+
+    prompt_embedding = await prompt_cache.embed_prompt(user_prompt)
+    if not bypass_cache and prompt_embedding is not None:
+        cached = await asyncio.to_thread(prompt_cache.get_similar, prompt_embedding, schema)
+        if cached is not None:
+            return models.WidgetCreate(**cached)
+
+    system_prompt = _render_system_prompt(schema)
     
-    model = genai.GenerativeModel('gemini-1.5-flash', generation_config={"response_mime_type": "application/json"})
+    cached_content = await asyncio.to_thread(_get_context_cache, system_prompt)
+    if cached_content is not None:
+        model = genai.GenerativeModel.from_cached_content(cached_content, generation_config=GENERATION_CONFIG)
+        contents = [user_prompt]
+    else:
+        model = _MODEL
+        contents = [system_prompt, user_prompt]
     
     print(f"Sending prompt to Gemini API for widget generation: '{user_prompt}'")
     try:
-        response = model.generate_content([system_prompt, user_prompt])
-        parsed_json = json.loads(response.text)
-        required_keys = ["name", "category", "python_code", "html_code"]
-        if not all(key in parsed_json for key in required_keys):
-            raise ValueError("AI response is missing required keys.")
+        response = await model.generate_content_async(contents)
+        # Parses the JSON and checks the required keys in a single pass.
+        widget_data = models.WidgetCreate.model_validate_json(response.text)
         
         print("Successfully received and validated widget code from Gemini API.")
-        return parsed_json
+    except ValidationError as e:
+        print(f"ERROR: Gemini API returned an invalid widget - {e}")
+        raise ValueError(f"AI response is not a valid widget: {e}")
     except Exception as e:
         print(f"ERROR: An error occurred with the Gemini API - {e}")
-        raise ValueError(f"Failed to generate widget from AI: {e}")
\ No newline at end of file
+        raise ValueError(f"Failed to generate widget from AI: {e}")
+
+    # Caching is best-effort: a failed write must not discard a successful generation.
+    try:
+        await asyncio.to_thread(prompt_cache.store, user_prompt, schema, widget_data.model_dump(), prompt_embedding)
+    except Exception as e:
+        print(f"Warning: Could not save AI response to prompt cache - {e}")
+    return widget_data
\ No newline at end of file
@@ -1,103 +1,231 @@
 import sqlite3
-import json
 import os
-import time
+import threading
 from datetime import datetime
+import orjson
 from . import models
 
 # --- CONFIGURATION ---
 # The single database for application data (members, sales, etc.)
 DATA_DB_FILE = "database/widgets.db"
-# Directory to store widget definitions as JSON files
+# Directory holding the widget store (and legacy per-widget JSON files)
 WIDGETS_DIR = "widgets"
+# SQLite database storing all widget definitions
+WIDGETS_DB_FILE = os.path.join(WIDGETS_DIR, "widgets.db")
+# Bumped whenever the widget store layout changes; tracked via PRAGMA user_version
+WIDGETS_DB_VERSION = 1
+
+# Widget definitions; usage counts live in the separate `widget_usage` table
+WIDGET_COLUMNS = "id, name, category, python_code, html_code, creation_date"
+SELECT_WIDGETS = f"""
+    SELECT {', '.join('w.' + column for column in WIDGET_COLUMNS.split(', '))},
+           COALESCE(u.usage_count, 0) AS usage_count
+    FROM widgets w LEFT JOIN widget_usage u ON u.widget_id = w.id
+"""
+
+# Memoized schema string, keyed on (file mtime, PRAGMA schema_version).
+_SCHEMA_CACHE: tuple[tuple[int, int], str] | None = None
+_SCHEMA_LOCK = threading.Lock()
+# Per-thread long-lived read-only connection to the DATA database.
+_DATA_CONN = threading.local()
+
+
+def _connect_widgets_db() -> sqlite3.Connection:
+    """Opens a connection to the widget store with per-connection tuning applied."""
+    conn = sqlite3.connect(WIDGETS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+
+def _row_to_widget(row: sqlite3.Row) -> models.Widget:
+    """
+    Builds a Widget from a store row without re-running pydantic validation.
+    Rows are only ever written by this module from validated models, so only
+    the creation date needs converting back from its ISO string.
+    """
+    data = dict(row)
+    data["creation_date"] = datetime.fromisoformat(data["creation_date"])
+    return models.Widget.model_construct(**data)
 
 
 def setup_storage():
     """
-    Initializes the application's storage directories.
+    Initializes the application's storage.
     - Ensures the 'database/' directory exists for the user-provided DB.
-    - Ensures the 'widgets/' directory exists for JSON widget files.
+    - Creates the widget store in 'widgets/widgets.db' if needed.
+    - Imports any legacy JSON widget files into the store (once).
     NOTE: This function ASSUMES 'database/widgets.db' is provided and populated.
     It does not create tables or add data.
     """
-    print("Setting up storage directories...")
+    print("Setting up storage...")
     os.makedirs("database", exist_ok=True)
     os.makedirs(WIDGETS_DIR, exist_ok=True)
-    print(f"Storage directory '{WIDGETS_DIR}' is ready.")
+    conn = _connect_widgets_db()
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS widgets (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    python_code TEXT NOT NULL,
+                    html_code TEXT NOT NULL,
+                    creation_date TEXT NOT NULL
+                );
+            """)
+            # Kept apart from `widgets` so bumping a counter rewrites a tiny row,
+            # not a row carrying the widget's whole source code.
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS widget_usage (
+                    widget_id INTEGER PRIMARY KEY,
+                    usage_count INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            _migrate_json_widgets(conn)
+            conn.execute(f"PRAGMA user_version={WIDGETS_DB_VERSION}")
+    finally:
+        conn.close()
+    print(f"Widget store '{WIDGETS_DB_FILE}' is ready.")
     print("Assuming 'database/widgets.db' is provided.")
 
 
+def _read_widget_file(entry: os.DirEntry) -> models.Widget | None:
+    """Parses one legacy JSON widget file, returning None if it is invalid."""
+    with open(entry.path, "rb") as f:
+        try:
+            return models.Widget(**orjson.loads(f.read()))
+        except (orjson.JSONDecodeError, TypeError, ValueError) as e:
+            print(f"Warning: Could not parse {entry.name}: {e}")
+            return None
+
+
+def _migrate_json_widgets(conn: sqlite3.Connection):
+    """One-time import of widgets stored as individual JSON files by older versions."""
+    rows = []
+    usage_rows = []
+    with os.scandir(WIDGETS_DIR) as it:
+        entries = [entry for entry in it if entry.name.endswith(".json") and entry.is_file()]
+    widgets = [_read_widget_file(entry) for entry in entries]
+    for widget in widgets:
+        if widget is None:
+            continue
+        data = widget.model_dump(mode='json')
+        rows.append(tuple(data[column] for column in WIDGET_COLUMNS.split(", ")))
+        usage_rows.append((widget.id, widget.usage_count))
+    with conn:
+        conn.executemany(f"INSERT OR IGNORE INTO widgets ({WIDGET_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT OR IGNORE INTO widget_usage (widget_id, usage_count) VALUES (?, ?)", usage_rows)
+    print(f"Migrated {len(rows)} JSON widget file(s) into '{WIDGETS_DB_FILE}'.")
+
+
 def create_widget(widget_data: models.WidgetCreate) -> models.Widget:
-    """Saves a new widget as a JSON file in the widgets/ directory."""
-    widget_id = int(time.time() * 1000)
+    """Saves a new widget as a row in the widget store. SQLite assigns the next free ID."""
+    creation_date = datetime.utcnow()
+    conn = _connect_widgets_db()
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO widgets (name, category, python_code, html_code, creation_date) VALUES (?, ?, ?, ?, ?)",
+                (widget_data.name, widget_data.category, widget_data.python_code, widget_data.html_code,
+                 creation_date.isoformat())
+            )
+    finally:
+        conn.close()
+
     new_widget = models.Widget(
-        id=widget_id,
-        creation_date=datetime.utcnow(),
+        id=cursor.lastrowid,
+        creation_date=creation_date,
         usage_count=0,
         **widget_data.model_dump()
     )
-    
-    file_path = os.path.join(WIDGETS_DIR, f"{widget_id}.json")
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(new_widget.model_dump(mode='json'), f, indent=4)
-        
-    print(f"Widget '{new_widget.name}' saved to {file_path}")
+    print(f"Widget '{new_widget.name}' saved to {WIDGETS_DB_FILE}")
     return new_widget
 
 def get_widget_by_id(widget_id: int) -> models.Widget | None:
-    """Retrieves a single widget by its ID from a JSON file."""
-    file_path = os.path.join(WIDGETS_DIR, f"{widget_id}.json")
-    if not os.path.exists(file_path):
+    """Retrieves a single widget by its ID from the widget store."""
+    conn = _connect_widgets_db()
+    try:
+        row = conn.execute(f"{SELECT_WIDGETS} WHERE w.id = ?", (widget_id,)).fetchone()
+    except OverflowError:
+        # IDs beyond SQLite's 64-bit integer range can't exist in the store.
         return None
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        return models.Widget(**data)
+    finally:
+        conn.close()
+    return _row_to_widget(row) if row else None
 
 def get_all_widgets() -> list[models.Widget]:
-    """Retrieves all widgets from the JSON files in the widgets/ directory."""
-    widgets = []
-    if not os.path.exists(WIDGETS_DIR):
-        return []
-    for filename in sorted(os.listdir(WIDGETS_DIR), reverse=True):
-        if filename.endswith(".json"):
-            file_path = os.path.join(WIDGETS_DIR, filename)
-            with open(file_path, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    widgets.append(models.Widget(**data))
-                except (json.JSONDecodeError, TypeError) as e:
-                    print(f"Warning: Could not parse {filename}: {e}")
-    return widgets
+    """Retrieves all widgets from the widget store, newest first."""
+    conn = _connect_widgets_db()
+    try:
+        rows = conn.execute(f"{SELECT_WIDGETS} ORDER BY w.id DESC").fetchall()
+    finally:
+        conn.close()
+    return [_row_to_widget(row) for row in rows]
 
 def increment_usage_count(widget_id: int):
-    """Increments the usage_count for a specific widget in its JSON file."""
-    widget = get_widget_by_id(widget_id)
-    if not widget:
-        return
-    
-    widget.usage_count += 1
-    file_path = os.path.join(WIDGETS_DIR, f"{widget_id}.json")
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(widget.model_dump(mode='json'), f, indent=4)
+    """Atomically increments the usage_count for a specific widget, touching only its counter row."""
+    conn = _connect_widgets_db()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO widget_usage (widget_id, usage_count) VALUES (?, 1) "
+                "ON CONFLICT(widget_id) DO UPDATE SET usage_count = usage_count + 1",
+                (widget_id,)
+            )
+    finally:
+        conn.close()
+
+
+def _get_data_db_conn() -> sqlite3.Connection:
+    """
+    Returns this thread's read-only connection to the DATA database, opening it on first use.
+    The connection is reopened if the database file has been replaced (e.g. regenerated).
+    """
+    inode = os.stat(DATA_DB_FILE).st_ino
+    conn = getattr(_DATA_CONN, "conn", None)
+    if conn is not None and _DATA_CONN.inode == inode:
+        return conn
+    if conn is not None:
+        conn.close()
+    conn = sqlite3.connect(f"file:{DATA_DB_FILE}?mode=ro", uri=True)
+    conn.execute("PRAGMA cache_size=-65536")
+    # Memory-map the file so reads are served from the page cache without read() syscalls.
+    conn.execute("PRAGMA mmap_size=268435456")
+    _DATA_CONN.conn = conn
+    _DATA_CONN.inode = inode
+    return conn
 
 
 def get_data_db_schema() -> str:
     """
     Introspects the DATA database and returns the CREATE TABLE statements.
     This provides the necessary context for the AI to write accurate queries.
+    The result is cached and only re-read when the schema version changes.
     """
-    print("Fetching DATA database schema for AI context...")
+    global _SCHEMA_CACHE
     if not os.path.exists(DATA_DB_FILE):
         raise ValueError(f"Database file not found at '{DATA_DB_FILE}'. Please provide the database.")
     try:
-        db_uri = f"file:{DATA_DB_FILE}?mode=ro"
-        with sqlite3.connect(db_uri, uri=True) as conn:
-            cursor = conn.cursor()
+        with _SCHEMA_LOCK:
+            cursor = _get_data_db_conn().cursor()
+            # schema_version catches in-place changes (including ones still in a WAL),
+            # the mtime catches the file being replaced by a freshly generated one.
+            schema_version = cursor.execute("PRAGMA schema_version").fetchone()[0]
+            cache_key = (os.stat(DATA_DB_FILE).st_mtime_ns, schema_version)
+            if _SCHEMA_CACHE is not None and _SCHEMA_CACHE[0] == cache_key:
+                return _SCHEMA_CACHE[1]
+
+            print("Fetching DATA database schema for AI context...")
             cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
             schema_parts = [row[1] for row in cursor.fetchall()]
             if not schema_parts:
                 raise ValueError(f"No tables found in the database '{DATA_DB_FILE}'.")
-        full_schema = "\n\n".join(schema_parts)
+            full_schema = "\n\n".join(schema_parts)
+            _SCHEMA_CACHE = (cache_key, full_schema)
         print("Schema fetched successfully.")
         return full_schema
     except sqlite3.Error as e:
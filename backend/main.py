@@ -1,6 +1,12 @@
+import io
 import os
+import re
+import sys
+import atexit
 import shutil
+import asyncio
 import tempfile
+from functools import lru_cache
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -10,7 +16,26 @@ from . import ai_integration, widget_runner, db, models
 
 # --- STARTUP CONFIGURATION ---
 print("Initializing AI Widget Generation Backend...")
-os.makedirs("uploads", exist_ok=True)
+# On-disk upload directory, used when tmpfs is unavailable or too full for an upload
+DISK_UPLOAD_DIR = "uploads"
+os.makedirs(DISK_UPLOAD_DIR, exist_ok=True)
+
+def _create_upload_dir() -> str:
+    """
+    Keeps uploads in RAM (tmpfs) where available; widgets read them straight back.
+    mkdtemp gives a fresh, private (0700) directory, so other local users can't
+    pre-create it or plant symlinks in it.
+    """
+    if sys.platform == "linux" and os.path.isdir("/dev/shm"):
+        try:
+            upload_dir = tempfile.mkdtemp(prefix="widget_uploads_", dir="/dev/shm")
+            atexit.register(shutil.rmtree, upload_dir, ignore_errors=True)
+            return upload_dir
+        except OSError as e:
+            print(f"Warning: Could not create tmpfs upload directory, using '{DISK_UPLOAD_DIR}' - {e}")
+    return DISK_UPLOAD_DIR
+
+UPLOAD_DIR = _create_upload_dir()
 db.setup_storage() # This sets up the required directories.
 
 app = FastAPI(
@@ -22,28 +47,79 @@ app = FastAPI(
 # --- CORS MIDDLEWARE ---
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
+    allow_origins=["*"], allow_credentials=False, allow_methods=["*"], allow_headers=["*"],
+    max_age=86400, # Let browsers reuse preflight results for a day
 )
 
+# --- HELPERS ---
+
+# Chunk size for copying in-memory uploads to disk
+UPLOAD_COPY_CHUNK = 1 << 20
+# Uploads smaller than this are handed to widgets in memory when they accept a file object
+IN_MEMORY_UPLOAD_LIMIT = 4 * 1024 * 1024
+
+@lru_cache(maxsize=256)
+def _accepts_file_object(python_code: str, key: str) -> bool:
+    """
+    Returns True if every use of `inputs[key]` in the widget code passes it straight
+    to `Image.open(...)`, which accepts a file object as well as a path. Any other
+    use (string methods, other libraries, ...) means the widget gets a real file path.
+    """
+    access = rf"""inputs\s*(?:\[\s*|\.get\(\s*)['"]{re.escape(key)}['"]"""
+    uses = len(re.findall(access, python_code))
+    direct_uses = len(re.findall(rf"Image\.open\(\s*{access}", python_code))
+    return uses > 0 and uses == direct_uses
+
+def _upload_dir_for(size: int | None) -> str:
+    """Picks UPLOAD_DIR if it has room for an upload of `size` bytes, else the on-disk directory."""
+    if UPLOAD_DIR == DISK_UPLOAD_DIR or size is None:
+        return DISK_UPLOAD_DIR
+    stats = os.statvfs(UPLOAD_DIR)
+    # tmpfs is often small (64 MB by default in Docker), so keep some headroom.
+    if size * 2 < stats.f_bavail * stats.f_frsize:
+        return UPLOAD_DIR
+    return DISK_UPLOAD_DIR
+
+def _save_upload(upload, fd: int):
+    """
+    Copies an uploaded file into the open file descriptor `fd`, closing it. Blocking; call via a worker thread.
+    Uploads that Starlette already spilled to disk are copied in-kernel with
+    os.sendfile; small in-memory uploads are copied in 1 MiB chunks.
+    """
+    source = upload.file
+    with os.fdopen(fd, "wb") as buffer:
+        # Checking `_rolled` first matters: fileno() would force an in-memory spool to disk.
+        if getattr(source, "_rolled", False) and hasattr(os, "sendfile"):
+            source.flush()
+            size = os.fstat(source.fileno()).st_size
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(buffer.fileno(), source.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, buffer, length=UPLOAD_COPY_CHUNK)
+
 # --- API ENDPOINTS ---
 
 @app.post("/generate_widget", response_model=models.Widget, tags=["Widgets"])
-def generate_widget_endpoint(request: models.PromptRequest):
+async def generate_widget_endpoint(request: models.PromptRequest):
     """
     Orchestrates the entire widget creation flow.
     """
     print(f"Received request to generate widget for prompt: '{request.prompt}'")
     try:
         # Step 1: Get the schema of the DATA database to give context to the AI.
-        schema = db.get_data_db_schema()
+        schema = await asyncio.to_thread(db.get_data_db_schema)
         
         # Step 2: Call the AI with the user's prompt AND the database schema.
-        ai_output = ai_integration.get_widget_code_from_gemini(request.prompt, schema)
-        widget_data = models.WidgetCreate(**ai_output)
+        widget_data = await ai_integration.get_widget_code_from_gemini(request.prompt, schema, request.bypass_cache)
         
-        # Step 3: Save the new widget's data to a JSON file.
-        new_widget = db.create_widget(widget_data)
-        print(f"Widget '{new_widget.name}' data saved to JSON with ID: {new_widget.id}")
+        # Step 3: Save the new widget to the widget store.
+        new_widget = await asyncio.to_thread(db.create_widget, widget_data)
+        print(f"Widget '{new_widget.name}' saved with ID: {new_widget.id}")
         
         return new_widget
     except ValueError as e:
@@ -53,7 +129,7 @@ def generate_widget_endpoint(request: models.PromptRequest):
 
 @app.get("/get_widgets", response_model=List[models.Widget], tags=["Widgets"])
 def get_widgets_endpoint():
-    """Provides the frontend with a list of all created widgets from JSON files."""
+    """Provides the frontend with a list of all created widgets."""
     return db.get_all_widgets()
 
 @app.get("/get_widget/{widget_id}", response_model=models.Widget, tags=["Widgets"])
@@ -66,37 +142,37 @@ def get_widget_endpoint(widget_id: int):
 
 @app.post("/run_widget/{widget_id}", tags=["Execution"])
 async def run_widget_endpoint(widget_id: int, request: Request):
-    """Executes a widget's code, loaded from its JSON file, with user-provided data."""
+    """Executes a widget's code, loaded from the widget store, with user-provided data."""
     inputs = {}
     temp_file_paths = []
     
-    widget = db.get_widget_by_id(widget_id)
+    widget = await asyncio.to_thread(db.get_widget_by_id, widget_id)
     if not widget:
         raise HTTPException(status_code=404, detail="Widget data not found.")
 
-    # Create a temporary file to execute the code
-    temp_py_file = None
     try:
-        # Create a named temporary file that widget_runner can import
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.py', encoding='utf-8') as temp_py_file:
-            temp_py_file.write(widget.python_code)
-            temp_py_path = temp_py_file.name
-        
         form_data = await request.form()
         for key, value in form_data.items():
             if hasattr(value, "filename") and value.filename: # Check if it is a file upload
-                # Ensure the uploads directory exists
-                os.makedirs("uploads", exist_ok=True)
-                temp_file_path = f"uploads/{value.filename}"
+                if (value.size is not None and value.size < IN_MEMORY_UPLOAD_LIMIT
+                        and _accepts_file_object(widget.python_code, key)):
+                    # Skip the disk round-trip; Image.open() reads the file object directly.
+                    blob = io.BytesIO(await value.read())
+                    blob.name = value.filename
+                    inputs[key] = blob
+                    continue
+                # Never build paths from the client-supplied filename; only keep its extension.
+                suffix = os.path.splitext(os.path.basename(value.filename))[1]
+                fd, temp_file_path = tempfile.mkstemp(dir=_upload_dir_for(value.size), suffix=suffix)
                 temp_file_paths.append(temp_file_path)
-                with open(temp_file_path, "wb") as buffer:
-                    shutil.copyfileobj(value.file, buffer)
+                await asyncio.to_thread(_save_upload, value, fd)
                 inputs[key] = temp_file_path # Pass the file path to the widget
             else:
                 inputs[key] = value
         
-        result = widget_runner.execute_widget_code(temp_py_path, inputs)
-        db.increment_usage_count(widget_id)
+        # Run off the event loop so a slow widget doesn't block other requests.
+        result = await asyncio.to_thread(widget_runner.execute_widget_code, widget.python_code, inputs, widget.category)
+        await asyncio.to_thread(db.increment_usage_count, widget_id)
         
         return JSONResponse(content={"output": str(result)})
     except Exception as e:
@@ -106,9 +182,6 @@ async def run_widget_endpoint(widget_id: int, request: Request):
         traceback.print_exc()
         return JSONResponse(content={"error": f"An error occurred during execution: {e}"}, status_code=500)
     finally:
-        # Clean up the temporary python file
-        if temp_py_file and os.path.exists(temp_py_file.name):
-            os.remove(temp_py_file.name)
         # Clean up any uploaded files
         for path in temp_file_paths:
             if os.path.exists(path):
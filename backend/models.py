@@ -4,6 +4,7 @@ from datetime import datetime
 class PromptRequest(BaseModel):
     """Defines the shape for the AI prompt request."""
     prompt: str
+    bypass_cache: bool = False
 
 class WidgetCreate(BaseModel):
     """Defines the data structure the AI must return to create a widget."""
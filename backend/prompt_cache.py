@@ -0,0 +1,131 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+import google.generativeai as genai
+import orjson
+
+# --- CONFIGURATION ---
+# Persistent store for AI responses so the cache survives restarts
+PROMPT_CACHE_FILE = "widgets/.prompt_cache.sqlite"
+# Embedding model used by the semantic (paraphrase) tier
+EMBEDDING_MODEL = "models/text-embedding-004"
+# Minimum cosine similarity for a paraphrased prompt to count as a hit
+SIMILARITY_THRESHOLD = 0.92
+
+# In-memory mirrors of the persistent store, loaded on first use.
+# _EXACT maps cache key -> response dict.
+# _VECTORS holds (schema_hash, unit embedding, cache key) for the semantic tier.
+_EXACT: dict[str, dict] | None = None
+_VECTORS: list[tuple[str, list[float], str]] = []
+_LOCK = threading.Lock()
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(PROMPT_CACHE_FILE), exist_ok=True)
+    conn = sqlite3.connect(PROMPT_CACHE_FILE)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS prompt_cache (
+            cache_key TEXT PRIMARY KEY,
+            schema_hash TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            embedding TEXT, -- JSON array of the normalized prompt embedding, if available
+            response TEXT NOT NULL, -- JSON object returned by the AI
+            created_at REAL NOT NULL
+        );
+    """)
+    return conn
+
+
+def _load():
+    """Loads the persistent cache into memory once per process. Caller must hold _LOCK."""
+    global _EXACT
+    if _EXACT is not None:
+        return
+    _EXACT = {}
+    conn = _connect()
+    try:
+        for cache_key, schema_hash, embedding, response in conn.execute(
+            "SELECT cache_key, schema_hash, embedding, response FROM prompt_cache"
+        ):
+            _EXACT[cache_key] = orjson.loads(response)
+            if embedding:
+                _VECTORS.append((schema_hash, orjson.loads(embedding), cache_key))
+    finally:
+        conn.close()
+    print(f"Loaded {len(_EXACT)} cached AI responses from {PROMPT_CACHE_FILE}.")
+
+
+def _normalize(vector: list[float]) -> list[float] | None:
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return None
+    return [x / norm for x in vector]
+
+
+async def embed_prompt(user_prompt: str) -> list[float] | None:
+    """
+    Returns the unit-length embedding of a prompt, or None if it could not be computed.
+    The semantic tier is best-effort, so embedding failures never block generation.
+    Requires genai to be configured by the caller.
+    """
+    try:
+        result = await genai.embed_content_async(model=EMBEDDING_MODEL, content=user_prompt, task_type="semantic_similarity")
+        return _normalize(result["embedding"])
+    except Exception as e:
+        print(f"Warning: Could not embed prompt for semantic cache - {e}")
+        return None
+
+
+def get_exact(user_prompt: str, schema: str) -> dict | None:
+    """Returns the cached AI response for exactly this prompt and schema, if any."""
+    with _LOCK:
+        _load()
+        return _EXACT.get(_hash(user_prompt + schema))
+
+
+def get_similar(embedding: list[float], schema: str) -> dict | None:
+    """Returns the cached response whose prompt is most similar to `embedding`, if above the threshold."""
+    schema_hash = _hash(schema)
+    with _LOCK:
+        _load()
+        best_key, best_score = None, SIMILARITY_THRESHOLD
+        for cached_schema_hash, vector, cache_key in _VECTORS:
+            if cached_schema_hash != schema_hash:
+                continue
+            score = sum(a * b for a, b in zip(vector, embedding))
+            if score >= best_score:
+                best_key, best_score = cache_key, score
+        if best_key is None:
+            return None
+        print(f"Semantic prompt cache hit (similarity {best_score:.3f}).")
+        return _EXACT[best_key]
+
+
+def store(user_prompt: str, schema: str, response: dict, embedding: list[float] | None = None):
+    """Saves an AI response both in memory and in the persistent cache file."""
+    cache_key = _hash(user_prompt + schema)
+    schema_hash = _hash(schema)
+    with _LOCK:
+        _load()
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO prompt_cache (cache_key, schema_hash, prompt, embedding, response, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (cache_key, schema_hash, user_prompt, orjson.dumps(embedding).decode() if embedding else None,
+                     orjson.dumps(response).decode(), time.time())
+                )
+        finally:
+            conn.close()
+        _EXACT[cache_key] = response
+        _VECTORS[:] = [entry for entry in _VECTORS if entry[2] != cache_key]
+        if embedding:
+            _VECTORS.append((schema_hash, embedding, cache_key))
@@ -1,40 +1,132 @@
-import importlib.util
+import hashlib
+import itertools
+import math
+import os
 import sys
+import threading
+import types
+from collections import OrderedDict
 
-def execute_widget_code(python_file_path: str, inputs: dict) -> any:
-    """
-    Dynamically loads a Python module from a file and executes its `run_widget` function.
+# Maximum number of compiled widget code objects kept in memory
+CODE_CACHE_SIZE = 128
 
-    WARNING: This method is NOT secure for production. It does not provide true sandboxing.
-    For a hackathon, it's a pragmatic solution. For a real product, use Docker containers
-    or a dedicated sandboxing library like `pychroot`.
-    """
-    module_name = "dynamic_widget_module"
+# Compiled widget code keyed by a digest of its source, least recently used first.
+# Only code objects are cached: each run executes them into a fresh module, so
+# widgets never share module-level state across runs or threads.
+_CODE_CACHE: "OrderedDict[bytes, types.CodeType]" = OrderedDict()
+_CODE_CACHE_LOCK = threading.Lock()
+# Makes each run's module name unique, so concurrent runs can register in sys.modules.
+_RUN_COUNTER = itertools.count()
+# Widgets run in worker threads, so matplotlib must never pick a GUI backend,
+# whichever widget happens to import pyplot first.
+os.environ["MPLBACKEND"] = "Agg"
+# matplotlib.pyplot, imported once by the first widget that uses it.
+_PYPLOT = None
+# pyplot keeps global figure state, so widgets using it must not run concurrently.
+_PYPLOT_LOCK = threading.Lock()
 
-    # Clean up any old versions of the module
-    if module_name in sys.modules:
-        del sys.modules[module_name]
 
-    try:
-        spec = importlib.util.spec_from_file_location(name=module_name, location=python_file_path)
-        if not spec or not spec.loader:
-            raise ImportError(f"Cannot create module spec from {python_file_path}")
+def _get_code(key: bytes, python_code: str) -> types.CodeType:
+    """Returns the compiled code object for `python_code` (digest `key`), compiling it only on the first call."""
+    with _CODE_CACHE_LOCK:
+        code_obj = _CODE_CACHE.get(key)
+        if code_obj is not None:
+            _CODE_CACHE.move_to_end(key)
+            return code_obj
+
+    code_obj = compile(python_code, f"<widget:{key.hex()}>", "exec")
+    with _CODE_CACHE_LOCK:
+        _CODE_CACHE[key] = code_obj
+        if len(_CODE_CACHE) > CODE_CACHE_SIZE:
+            _CODE_CACHE.popitem(last=False)
+    return code_obj
 
-        widget_module = importlib.util.module_from_spec(spec)
-        sys.modules[module_name] = widget_module
 
-        spec.loader.exec_module(widget_module)
+def _run_widget_code(python_code: str, inputs: dict, preset_globals: dict | None = None) -> any:
+    """
+    Executes `python_code` into a fresh module and calls its `run_widget` function.
+    `preset_globals` are bound in the module namespace before its code runs.
+    The module is registered in `sys.modules` only while it runs (dataclasses, pickle
+    and friends look classes up there), under a per-run name so concurrent runs
+    of the same widget never collide.
+    """
+    key = hashlib.blake2b(python_code.encode("utf-8"), digest_size=16).digest()
+    code_obj = _get_code(key, python_code)
+    module_name = f"<widget:{key.hex()}:{next(_RUN_COUNTER)}>"
+    module = types.ModuleType(module_name)
+    if preset_globals:
+        module.__dict__.update(preset_globals)
 
-        if not hasattr(widget_module, 'run_widget'):
+    sys.modules[module_name] = module
+    try:
+        exec(code_obj, module.__dict__)
+
+        if not hasattr(module, 'run_widget'):
             raise AttributeError("Widget code is missing the required 'run_widget' function.")
 
-        run_function = getattr(widget_module, 'run_widget')
-        result = run_function(inputs)
-        return result
+        run_function = getattr(module, 'run_widget')
+        return run_function(inputs)
+    finally:
+        sys.modules.pop(module_name, None)
+
+
+def _get_pyplot():
+    """Imports matplotlib.pyplot once (using the Agg backend forced above)."""
+    global _PYPLOT
+    if _PYPLOT is None:
+        import matplotlib.pyplot as plt
+        _PYPLOT = plt
+    return _PYPLOT
+
+
+def _uses_matplotlib(python_code: str) -> bool:
+    """True if the widget may touch pyplot, directly or through pandas' .plot()/.hist()."""
+    return "matplotlib" in python_code or ".plot(" in python_code or ".hist(" in python_code
+
+
+def _run_default(python_code: str, inputs: dict) -> any:
+    return _run_widget_code(python_code, inputs)
+
+
+def _run_numerical(python_code: str, inputs: dict) -> any:
+    """Calculators: `math` is pre-bound so the widget can use it without importing."""
+    return _run_widget_code(python_code, inputs, {"math": math})
+
+
+def _run_with_pyplot(executor, python_code: str, inputs: dict) -> any:
+    """Runs a matplotlib widget alone on pyplot and closes its figures afterwards."""
+    with _PYPLOT_LOCK:
+        plt = _get_pyplot()
+        try:
+            return executor(python_code, inputs)
+        finally:
+            # Figures stay registered with pyplot until closed, which leaks memory across runs.
+            plt.close("all")
+
+
+# Specialized executors by widget category; anything else uses _run_default.
+EXECUTORS = {
+    "numerical": _run_numerical,
+}
+
+
+def execute_widget_code(python_code: str, inputs: dict, category: str | None = None) -> any:
+    """
+    Loads a widget's Python source as a module and executes its `run_widget` function.
+    Compiled code is cached by source, so repeat runs skip compilation entirely.
+    The widget's `category` selects a specialized executor from EXECUTORS, if any.
+    Widgets that use matplotlib are serialized on pyplot whatever their category.
+
+    WARNING: This method is NOT secure for production. It does not provide true sandboxing.
+    For a hackathon, it's a pragmatic solution. For a real product, use Docker containers
+    or a dedicated sandboxing library like `pychroot`.
+    """
+    executor = EXECUTORS.get(category, _run_default)
+    try:
+        if _uses_matplotlib(python_code):
+            return _run_with_pyplot(executor, python_code, inputs)
+        return executor(python_code, inputs)
     except Exception as e:
-        print(f"Error executing widget code from {python_file_path}: {e}")
+        print(f"Error executing widget code: {e}")
         # Re-raise the exception to be caught by the API endpoint
         raise
-    finally:
-        if module_name in sys.modules:
-            del sys.modules[module_name]
\ No newline at end of file
@@ -1,14 +1,15 @@
 import os
 import sqlite3
-import random
 import json
-from datetime import datetime, timedelta
+from datetime import datetime
+import numpy as np
 from faker import Faker
 from tqdm import tqdm # A progress bar library, install with 'pip install tqdm'
 
 # --- CONFIGURATION ---
 DB_FILE = "database/membership_sales.db"
 NUM_MEMBERS = 10000
+DAY_US = 24 * 60 * 60 * 1_000_000
 
 # Initialize Faker for generating realistic data
 fake = Faker()
@@ -145,19 +146,34 @@ def populate_static_tables(conn):
     }
 
 
+def _to_iso(timestamps_us, unit="us"):
+    """Formats an array of microsecond timestamps as ISO strings, truncated to `unit`."""
+    return np.datetime_as_string(timestamps_us.astype("datetime64[us]").astype(f"datetime64[{unit}]")).tolist()
+
+
+def _random_between(start_us, end_us):
+    """Draws one uniform timestamp between each pair of microsecond bounds."""
+    return start_us + (np.random.random(len(start_us)) * (end_us - start_us)).astype(np.int64)
+
+
 def generate_dynamic_data(conn, static_ids):
     """Generates the main bulk of the data for members, sales, and tickets."""
     cursor = conn.cursor()
+    now_us = np.datetime64(datetime.now(), "us").astype(np.int64)
     
     # --- Generate Members ---
     print(f"Generating {NUM_MEMBERS} unique members...")
-    members_to_insert = []
     # Weighted choices: More Bronze/Silver members than Platinum
     tier_weights = [0.4, 0.3, 0.2, 0.1] 
-    
-    for _ in tqdm(range(NUM_MEMBERS), desc="Generating Members"):
-        join_date = fake.date_time_between(start_date="-5y", end_date="now")
-        members_to_insert.append((
+    join_us = now_us - np.random.randint(0, 5 * 365 * DAY_US, NUM_MEMBERS)
+    birth_us = now_us - np.random.randint(18 * 365 * DAY_US, 81 * 365 * DAY_US, NUM_MEMBERS)
+    tier_ids = np.random.choice(static_ids["tier_ids"], size=NUM_MEMBERS, p=tier_weights).tolist()
+    campaign_choices = static_ids["campaign_ids"] + [None] # Some members join organically
+    campaign_ids = [campaign_choices[i] for i in np.random.randint(0, len(campaign_choices), NUM_MEMBERS)]
+    is_active = (np.random.random(NUM_MEMBERS) < 0.9).astype(int).tolist() # 90% are active
+
+    text_fields = [
+        (
             fake.first_name(),
             fake.last_name(),
             fake.unique.email(),
@@ -166,85 +182,92 @@ def generate_dynamic_data(conn, static_ids):
             fake.city(),
             fake.state_abbr(),
             fake.zipcode(),
-            join_date.isoformat(),
-            fake.date_of_birth(minimum_age=18, maximum_age=80).isoformat(),
-            random.choices(static_ids["tier_ids"], weights=tier_weights, k=1)[0],
-            random.choice(static_ids["campaign_ids"] + [None]), # Some members join organically
-            random.choices([1, 0], weights=[0.9, 0.1], k=1)[0] # 90% are active
-        ))
+        )
+        for _ in tqdm(range(NUM_MEMBERS), desc="Generating Members")
+    ]
+    members_to_insert = [
+        fields + (join_date, date_of_birth, tier_id, campaign_id, active)
+        for fields, join_date, date_of_birth, tier_id, campaign_id, active in zip(
+            text_fields, _to_iso(join_us), _to_iso(birth_us, unit="D"), tier_ids, campaign_ids, is_active
+        )
+    ]
     cursor.executemany("""
         INSERT INTO members (first_name, last_name, email, phone_number, address, city, state, zip_code, 
         join_date, date_of_birth, membership_tier_id, source_campaign_id, is_active)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, members_to_insert)
-    conn.commit()
 
-    # Get all member IDs and their join dates for relational integrity
-    member_data = list(cursor.execute("SELECT member_id, join_date FROM members"))
+    # Member IDs in insertion order, aligned with join_us for relational integrity
+    member_ids = np.array([row[0] for row in cursor.execute("SELECT member_id FROM members ORDER BY member_id")])
 
     # --- Generate Sales ---
     print("Generating sales data (approx. 15,000 records)...")
-    sales_to_insert = []
-    for member_id, join_date_str in tqdm(member_data, desc="Generating Sales"):
-        # Each member makes between 0 and 5 purchases
-        num_purchases = random.randint(0, 5)
-        if num_purchases == 0:
-            continue
-        
-        member_join_date = datetime.fromisoformat(join_date_str)
-
-        for _ in range(num_purchases):
-            product_id, price = random.choice(static_ids["products"])
-            quantity = random.randint(1, 3)
-            sale_date = fake.date_time_between(start_date=member_join_date, end_date="now")
-            sales_to_insert.append((
-                member_id,
-                product_id,
-                quantity,
-                sale_date.isoformat(),
-                round(price * quantity, 2)
-            ))
+    # Each member makes between 0 and 5 purchases
+    sale_members = np.repeat(np.arange(NUM_MEMBERS), np.random.randint(0, 6, NUM_MEMBERS))
+    num_sales = len(sale_members)
+    product_ids = np.array([product_id for product_id, _ in static_ids["products"]])
+    prices = np.array([price for _, price in static_ids["products"]])
+    product_idx = np.random.randint(0, len(product_ids), num_sales)
+    quantities = np.random.randint(1, 4, num_sales)
+    sale_us = _random_between(join_us[sale_members], now_us)
+    sales_to_insert = zip(
+        member_ids[sale_members].tolist(),
+        product_ids[product_idx].tolist(),
+        quantities.tolist(),
+        _to_iso(sale_us),
+        np.round(prices[product_idx] * quantities, 2).tolist()
+    )
     cursor.executemany("""
         INSERT INTO sales (member_id, product_id, quantity, sale_date, total_price)
         VALUES (?, ?, ?, ?, ?)
     """, sales_to_insert)
-    conn.commit()
 
     # --- Generate Support Tickets ---
     print("Generating support ticket data (approx. 10,000 records)...")
-    tickets_to_insert = []
     ticket_subjects = ['Billing Inquiry', 'Technical Issue', 'Feature Request', 'Account Access Problem', 'General Question']
     status_choices = ['Open', 'In Progress', 'Resolved', 'Closed']
     status_weights = [0.05, 0.1, 0.2, 0.65] # Most tickets are closed
 
-    for member_id, join_date_str in tqdm(member_data, desc="Generating Tickets"):
-        # Not every member creates a ticket
-        if random.random() > 0.7: # Approx 70% of members will have at least one ticket
-            continue
-        
-        member_join_date = datetime.fromisoformat(join_date_str)
-
-        for _ in range(random.randint(1, 3)): # Between 1 and 3 tickets
-            created_at = fake.date_time_between(start_date=member_join_date, end_date="now")
-            status = random.choices(status_choices, weights=status_weights, k=1)[0]
-            resolved_at = None
-            if status in ['Resolved', 'Closed']:
-                resolved_at = fake.date_time_between(start_date=created_at, end_date=created_at + timedelta(days=14)).isoformat()
-
-            tickets_to_insert.append((
-                member_id,
-                random.choice(ticket_subjects),
-                status,
-                created_at.isoformat(),
-                resolved_at
-            ))
+    # Approx 70% of members will have between 1 and 3 tickets
+    has_tickets = np.random.random(NUM_MEMBERS) <= 0.7
+    ticket_members = np.repeat(np.arange(NUM_MEMBERS), np.where(has_tickets, np.random.randint(1, 4, NUM_MEMBERS), 0))
+    num_tickets = len(ticket_members)
+    created_us = _random_between(join_us[ticket_members], now_us)
+    statuses = np.random.choice(status_choices, size=num_tickets, p=status_weights)
+    resolved_us = _random_between(created_us, created_us + 14 * DAY_US)
+    is_resolved = np.isin(statuses, ['Resolved', 'Closed']).tolist()
+    tickets_to_insert = zip(
+        member_ids[ticket_members].tolist(),
+        np.random.choice(ticket_subjects, size=num_tickets).tolist(),
+        statuses.tolist(),
+        _to_iso(created_us),
+        [resolved if done else None for resolved, done in zip(_to_iso(resolved_us), is_resolved)]
+    )
     cursor.executemany("""
         INSERT INTO support_tickets (member_id, subject, status, created_at, resolved_at)
         VALUES (?, ?, ?, ?, ?)
     """, tickets_to_insert)
+
+    # All members, sales and tickets are written in a single transaction.
     conn.commit()
 
 
+def create_indexes(conn):
+    """Adds indexes for the joins and filters AI-generated widget queries commonly use."""
+    cursor = conn.cursor()
+    print("Creating indexes...")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_member ON sales(member_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_product ON sales(product_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_tier ON members(membership_tier_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_campaign ON members(source_campaign_id);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_member ON support_tickets(member_id);")
+    conn.commit()
+    # Gather statistics so the query planner can choose between the new indexes.
+    cursor.execute("ANALYZE;")
+    conn.commit()
+    print("Indexes created.")
+
+
 def main():
     """Main function to orchestrate the database creation and population."""
     # Ensure the 'database' directory exists
@@ -257,9 +280,20 @@ def main():
 
     try:
         conn = sqlite3.connect(DB_FILE)
+        # Bulk-load settings: durability is irrelevant while generating from scratch.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-100000")
+        conn.execute("PRAGMA foreign_keys=OFF")
         create_database_schema(conn)
         static_ids = populate_static_tables(conn)
         generate_dynamic_data(conn, static_ids)
+        create_indexes(conn)
+
+        conn.execute("PRAGMA foreign_keys=ON")
+        # Checkpoint the WAL back into a single self-contained file for the backend.
+        conn.execute("PRAGMA journal_mode=DELETE")
         
         print("\n--- DATABASE GENERATION COMPLETE! ---")
         print(f"Database saved to: {DB_FILE}")